@@ -1,5 +1,7 @@
 #builtin
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 # 3rd party
 from PyQt5 import QtCore, QtGui, QtWidgets
 # local
@@ -9,6 +11,11 @@ from from_pupil.player_methods import is_pupil_rec_dir
 from from_pupil.extract_diameter import process_recording 
 from from_pupil.extract_diameter import process_recording_annotations
 
+logger = logging.getLogger(__name__)
+
+# Key of the window icon in the QPixmapCache
+_icon_key = 'batch_exporter_icon'
+
 class dragApp(QtWidgets.QWidget):
 
     def __init__(self):
@@ -17,14 +24,12 @@ class dragApp(QtWidgets.QWidget):
         else: 
             self._app = QtWidgets.QApplication.instance()
         super().__init__()
-        pix = QtGui.QPixmap(os.path.join(_dir, 'icon.png'))
-        self.icon = QtGui.QIcon(pix)
+        self.icon = getIcon()
         self.setWindowIcon(self.icon)
         self.setWindowTitle('Batch exporter')
 
         self.target_path = ''     
         self.recordings = None
-        self.levels = None
 
         self.setAcceptDrops(True)
         self.setEnabled(True)
@@ -48,11 +53,16 @@ class dragApp(QtWidgets.QWidget):
         font.setBold(True)
         self.stack_wait.setFont(font)
 
+        # Refilled on every drop
+        self.tree = QtWidgets.QTreeWidget()
+        self.tree.setHeaderLabel('Recordings architecture')
+
         self.layout().addWidget(
             self.stack, 
             stretch = 5
             )
         self.stack.addWidget(self.stack_wait)
+        self.stack.addWidget(self.tree)
         self.stack.setCurrentWidget(self.stack_wait)
 
     def setup_side_panel(self):
@@ -84,43 +94,50 @@ class dragApp(QtWidgets.QWidget):
 
     # The drag and drop section
     def dropEvent(self, e):
-        self.tree = QtWidgets.QTreeWidget()
-        self.tree.setHeaderLabel('Recordings architecture')
-        self.stack.addWidget(self.tree)
         self.target_path = ''  
-
         e.acceptProposedAction()
         data =  e.mimeData()
 
         recordings = None
-        levels = []
+        tree_items = []
         if data.hasUrls():
             for url in data.urls():
                 # Uniform path
                 path = url.toLocalFile()
                 path = os.path.abspath(path)
 
-                (url_tree_item, url_recordings, url_levels) = getTree(path)
+                # Only directories can be recordings, below this the
+                # walk knows the type of each entry
+                if not os.path.isdir(path):
+                    continue
+
+                (url_tree_item, url_recordings) = getTree(path)
                 if url_tree_item is None:
                     continue
                 
                 if recordings is None:
                     recordings = url_recordings
-                    levels = url_levels
                 else:
                     recordings.extend(url_recordings)
-                    levels.extend(url_levels)
                 
                 # Choose a location for grouped exports
                 if len(self.target_path) < 1:
                     self.target.setText(os.path.join(path, 'exports'))
 
-                self.tree.addTopLevelItem(url_tree_item)
-                self.stack.setCurrentWidget(self.tree)
+                tree_items.append(url_tree_item)
+
+        if len(tree_items) > 0:
+            # Fill the tree at once, without a repaint for each item
+            self.tree.setUpdatesEnabled(False)
+            self.tree.blockSignals(True)
+            self.tree.clear()
+            self.tree.addTopLevelItems(tree_items)
+            self.tree.blockSignals(False)
+            self.tree.setUpdatesEnabled(True)
+            self.stack.setCurrentWidget(self.tree)
                 
         if recordings is not None:
             self.recordings = recordings
-            self.levels = levels
 
     # Override events
     def dragEnterEvent(self, e):
@@ -144,83 +161,145 @@ class dragApp(QtWidgets.QWidget):
         omit = self.chkbox_omit.isChecked()
         target = self.target_path
         annotation = self.chkbox_annotation.isChecked()
-        level = self.levels
-
-        for (rec, lvl) in zip(recordings, level):
+        # The first level folders do not change during the export
+        folders = [
+            self.tree.topLevelItem(ix).text(0)
+            for ix in range(self.tree.topLevelItemCount())
+            ]
+
+        # Local names for the loop, it runs once per recording
+        join = os.path.join
+        makedirs = os.makedirs
+
+        # Prepare the exports here, they are run afterwards
+        tasks = []
+        annotation_tasks = []
+        if group:
+            makedirs(target, exist_ok = True)
+        for recording in recordings:
+            rec = recording['path']
+            lvl = recording['level']
             name = 'pupil_positions'
             if omit:
-                for ix in range(self.tree.topLevelItemCount()):
-                    folder = self.tree.topLevelItem(ix).text(0)
+                for folder in folders:
                     if folder in lvl:
                         lvl = lvl[len(folder)+1:]
 
             if not group:
-                target = os.path.join(rec, 'exports')
+                target = join(rec, 'exports')
+                makedirs(target, exist_ok = True)
             else:
                 name += '_' + lvl
 
-            if not os.path.exists(target):
-                os.mkdir(target)
-
-            process_recording(rec, name + '.csv', target, overwrite = True)
+            tasks.append((rec, name + '.csv', target))
             if annotation:
                 name = 'annotations'
                 if group:
                     name += '_' + lvl
-                process_recording_annotations(
-                    rec, name + '.csv', target, overwrite = True)
+                annotation_tasks.append((rec, name + '.csv', target))
+
+        # The recordings are independent, export them concurrently. The
+        # widgets are only updated once all of them are done
+        with ThreadPoolExecutor(max_workers = os.cpu_count()) as executor:
+            list(executor.map(
+                lambda group: [
+                    process_recording(*task, overwrite = True)
+                    for task in group
+                    ],
+                groupTasks(tasks)
+                ))
+            list(executor.map(
+                lambda group: [
+                    process_recording_annotations(*task, overwrite = True)
+                    for task in group
+                    ],
+                groupTasks(annotation_tasks)
+                ))
 
         self.stack.setCurrentWidget(self.stack_wait)
         self.stack_wait.setText('Done! \n Drop another folder here')
         self.target_path = ''     
         self.recordings = None
-        self.levels = None
 
-def getTree(path, tree = None):
+def getIcon():
+    # The icon is only read from disk for the first window
+    pix = QtGui.QPixmapCache.find(_icon_key)
+    if pix is None or pix.isNull():
+        pix = QtGui.QPixmap(os.path.join(_dir, 'icon.png'))
+        QtGui.QPixmapCache.insert(_icon_key, pix)
+    return QtGui.QIcon(pix)
+
+def groupTasks(tasks):
+    # Exports into the same csv file, e.g. grouped exports of equally named
+    # recordings, can not run concurrently. They are grouped to run one
+    # after the other in their drop order, the last one wins
+    groups = {}
+    for task in tasks:
+        csv_path = os.path.normcase(os.path.join(task[2], task[1]))
+        groups.setdefault(csv_path, []).append(task)
+    for csv_path, group in groups.items():
+        if len(group) > 1:
+            logger.warning("{} recordings are exported to {}, keeping {}".format(
+                len(group), csv_path, group[-1][0]))
+    return list(groups.values())
+
+def getTree(path, tree = None, entry = None):
+    # path has to be a directory, entry is its DirEntry when walking down.
+    # Everything the export needs to know about a recording is collected
+    # here, while the folders are in the file system cache
 
     # Init
     recordings = []
-    level = []
     if tree is None:
         tree = QtWidgets.QTreeWidgetItem()
 
-    # Only directories can be recordings
-    if not os.path.isdir(path):
-        return tree, recordings, level
-        
-    cur_di = path.split(os.sep)[-1]
-
-    # Is the directory a recording
-    if is_pupil_rec_dir(path):
-        recordings.append(path) 
+    if entry is None:
+        cur_di = os.path.basename(path)
+    else:
+        cur_di = entry.name
+
+    # List the directory once, the names tell if it is a recording
+    with os.scandir(path) as it:
+        entries = list(it)
+    names = {di_entry.name for di_entry in entries}
+
+    # Is the directory a recording, the meta info file is only parsed
+    # for the directories that have one
+    if is_pupil_rec_dir(path, names):
+        recordings.append({
+            'path': path,
+            'level': cur_di,
+            })
         tree.setText(0, cur_di) 
-        level.append(cur_di)
 
     else: 
         # Look into the directory
-        dirs = os.listdir(path)
-        for di in dirs:
+        for di_entry in entries:
             # Remove the hidden files
-            if di.startswith('.'):
+            if di_entry.name.startswith('.'):
                 continue
-            
+            # Only directories can be recordings, scandir already
+            # knows the type so this does not stat the entry
+            if not di_entry.is_dir(follow_symlinks = False):
+                continue
+
             # Create a new tree for each directory
-            di_path = os.path.join(path, di)
             di_tree = QtWidgets.QTreeWidgetItem()
 
             # Recursion
-            (di_tree, rec, lvl) = getTree(di_path, tree = di_tree)
+            (di_tree, rec) = getTree(
+                di_entry.path, tree = di_tree, entry = di_entry)
             # If there was a recording we need to have the different 
             # levels
             if len(rec) > 0:
-                di_tree.setText(0, di)
+                di_tree.setText(0, di_entry.name)
                 tree.setText(0, cur_di)
                 tree.addChild(di_tree)
+                for recording in rec:
+                    recording['level'] = cur_di + '_' + recording['level']
                 recordings.extend(rec)
-                new_level = [cur_di + '_' + lev for lev in lvl]  
-                level.extend(new_level)
             
-    return tree, recordings, level    
+    return tree, recordings
 
 if __name__ == '__main__':
     wid = dragApp()
@@ -1,7 +1,12 @@
 import argparse
 import csv
+import functools
+import itertools
+import json
 import logging
+import operator
 import os
+import threading
 import traceback as tb
 
 import numpy as np
@@ -10,6 +15,15 @@ import sys
 
 logger = logging.getLogger(__name__)
 
+# Write buffer of the exported csv files, rows are small and many
+CSV_BUFFER_SIZE = 1 << 20
+# Stored next to the exported csv files, see is_export_up_to_date()
+EXPORT_CACHE_FILE = ".export_cache.json"
+# Recordings can be exported from several threads into the same directory
+_export_cache_lock = threading.Lock()
+# Pupil samples decoded and written per block while exporting
+CHUNK_SIZE = 8192
+
 def main(recordings, csv_out, out_directory = '', overwrite=False, annotations = True):
     """Process given recordings one by one
 
@@ -25,7 +39,9 @@ def main(recordings, csv_out, out_directory = '', overwrite=False, annotations =
         try:
             logger.info("Extracting {}...".format(rec))
             #pm.update_recording_to_recent(rec)
-            process_recording(rec, csv_out[idx], out_directory, overwrite=overwrite)
+            # The command line overwrite is explicit, the export cache is bypassed
+            process_recording(
+                rec, csv_out[idx], out_directory, overwrite=overwrite, force=overwrite)
             if annotations:
                 process_recording_annotations(rec, csv_out[idx+1], out_directory, overwrite=overwrite)
 
@@ -45,33 +61,101 @@ def main(recordings, csv_out, out_directory = '', overwrite=False, annotations =
             idx += 1
     return
 
-def process_recording(recording, csv_out, out_directory, overwrite=False):
+def process_recording(recording, csv_out, out_directory, overwrite=False, force=False):
     """Process a single recording
 
     recordings: List of recording folders
     csv_out: CSV file name under which the result will be saved
-    overwrite: Boolean indicating if an existing csv file should be overwritten
+    overwrite: Boolean indicating if an existing csv file should be overwritten,
+        it is skipped anyway if the pupil data did not change since its export
+    force: Boolean indicating if an up to date csv file should be overwritten
     """
     if len(out_directory) == 0:
         csv_out_path = os.path.join(recording, csv_out)
     else:
         csv_out_path = os.path.join(out_directory, csv_out)
 
+    # Taken before reading, a pupil data change during the export then
+    # makes the export outdated
+    src_mtime = source_mtime(recording)
+
     if os.path.exists(csv_out_path):
         if not overwrite:
             logger.warning("{} exists already! Not overwriting.".format(csv_out_path))
             return
+        elif not force and is_export_up_to_date(recording, csv_out_path, src_mtime):
+            logger.warning("{} is up to date! Not overwriting.".format(csv_out_path))
+            return
         else:
             logger.warning("{} exists already! Overwriting.".format(csv_out_path))
 
-    with open(csv_out_path, "w", newline = '') as csv_file:
+    with open(
+        csv_out_path, "w", newline = '', buffering = CSV_BUFFER_SIZE
+        ) as csv_file:
         writer = csv.writer(csv_file, dialect=csv.get_dialect('excel'))
         writer.writerow(csv_header())
 
-        extracted_rows = load_and_yield_data(recording)
-        writer.writerows(extracted_rows)
+        chunks = load_and_yield_data(recording, chunk_size = CHUNK_SIZE)
+        for rows in chunks:
+            writer.writerows(rows)
+
+    update_export_cache(recording, csv_out_path, src_mtime)
     return
 
+def source_mtime(recording):
+    """Modification time of the pupil data of a recording, None if missing"""
+    try:
+        return os.stat(data_files(recording)[1]).st_mtime
+    except FileNotFoundError:
+        return None
+
+def is_export_up_to_date(recording, csv_out_path, src_mtime):
+    """Check if a csv file was exported from the current pupil data
+
+    The modification times of the export are looked up in the export cache
+    of its directory. Exports missing from the cache, e.g. interrupted ones,
+    are never up to date.
+    """
+    if src_mtime is None:
+        return False
+    try:
+        csv_mtime = os.stat(csv_out_path).st_mtime
+    except FileNotFoundError:
+        return False
+
+    out_directory, csv_name = os.path.split(csv_out_path)
+    entry = load_export_cache(out_directory).get(csv_name)
+    return entry == [recording, src_mtime, csv_mtime]
+
+def load_export_cache(out_directory):
+    """Load the export cache of a directory
+
+    Returns: dict csv file name -> [recording, pupil data mtime, csv mtime]
+    """
+    try:
+        with open(os.path.join(out_directory, EXPORT_CACHE_FILE), "r") as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def update_export_cache(recording, csv_out_path, src_mtime):
+    """Record the modification times of a fresh export"""
+    if src_mtime is None:
+        # Nothing was exported
+        return
+    try:
+        entry = [recording, src_mtime, os.stat(csv_out_path).st_mtime]
+    except FileNotFoundError:
+        # Nothing was exported
+        return
+
+    out_directory, csv_name = os.path.split(csv_out_path)
+    with _export_cache_lock:
+        cache = load_export_cache(out_directory)
+        cache[csv_name] = entry
+        with open(os.path.join(out_directory, EXPORT_CACHE_FILE), "w") as fh:
+            json.dump(cache, fh)
+
 def process_recording_annotations(recording, csv_out, out_directory, overwrite=False):
     """Process a single recording
 
@@ -91,7 +175,7 @@ def process_recording_annotations(recording, csv_out, out_directory, overwrite=F
         else:
             logger.warning("{} exists already! Overwriting.".format(csv_out_path))
 
-    with open(csv_out_path, "w") as csv_file:
+    with open(csv_out_path, "w", buffering = CSV_BUFFER_SIZE) as csv_file:
         writer = csv.writer(csv_file, dialect=csv.unix_dialect, quoting = csv.QUOTE_NONE)
         writer.writerow(csv_header_annotations())
 
@@ -124,17 +208,20 @@ def csv_header_annotations():
     )
 
 def load_and_yield_annotations(directory, topic = 'notify'):
-    if not os.path.exists(os.path.join(directory, topic + "_timestamps.npy")):
+    # Join once, the files only differ by their names
+    prefix = os.path.join(directory, '')
+    if not os.path.exists(prefix + topic + "_timestamps.npy"):
         topic = 'annotation'
     try:
-        ts_file = os.path.join(directory, topic + "_timestamps.npy")
+        ts_file = prefix + topic + "_timestamps.npy"
         data_ts = np.load(ts_file)
 
-        msgpack_file = os.path.join(directory, topic + ".pldata")
+        msgpack_file = prefix + topic + ".pldata"
         with open(msgpack_file, "rb") as fh:
             unpacker = msgpack.Unpacker(fh, raw=False, use_list=False)
             for timestamp, (topic, payload) in zip(data_ts, unpacker):
-                datum = deserialize_msgpack(payload)
+                # The payloads are msgpack encoded bytes as well
+                datum = msgpack.unpackb(payload, raw=False, use_list=False)
                 label = extract_eyeid_messages(datum)
                 yield(timestamp, label)
     except FileNotFoundError:
@@ -143,9 +230,13 @@ def load_and_yield_annotations(directory, topic = 'notify'):
 
     return
 
-def load_and_yield_data(directory, topic="pupil"):
+def load_and_yield_data(directory, topic="pupil", chunk_size=None):
     """Load and extract pupil diameter data
 
+    The data is yielded in blocks of at most `chunk_size` samples, all of
+    them at once by default. Each block is a list of rows following the
+    csv_header() sequence, the values are kept as they were recorded.
+
     See the data format documentation[2] for details on the data structure.
 
     Adapted open-source code from Pupil Player[1] to read pldata files.
@@ -155,47 +246,66 @@ def load_and_yield_data(directory, topic="pupil"):
     [1] https://github.com/pupil-labs/pupil/blob/master/pupil_src/shared_modules/file_methods.py#L137-L153
     [2] https://docs.pupil-labs.com/#data-files
     """
+    ts_file, msgpack_file = data_files(directory, topic)
     try:
-        offline = os.path.join(directory, 'offline_data', 'offline_' + topic + "_timestamps.npy")
-        if not os.path.isfile(offline):
-            ts_file = os.path.join(directory, topic + "_timestamps.npy")
-            data_ts = np.load(ts_file)
-
-            msgpack_file = os.path.join(directory, topic + ".pldata")
-        else:
-            ts_file = offline
-            data_ts = np.load(ts_file)
+        data_ts = np.load(ts_file)
 
-            msgpack_file = os.path.join(directory, 'offline_data', 'offline_' + topic + ".pldata")
+        n_total = len(data_ts)
+        if chunk_size is None:
+            chunk_size = n_total
 
         with open(msgpack_file, "rb") as fh:
             unpacker = msgpack.Unpacker(fh, raw=False, use_list=False)
-            for timestamp, (topic, payload) in zip(data_ts, unpacker):
-                datum = deserialize_msgpack(payload)
-
-                # custom extraction function for pupil data, see below for details
-                print(datum)
-                eye_id, conf, dia_2d, dia_3d, pos_x, pos_y = extract_eyeid_diameters(datum)
-                # yield data according to csv_header() sequence
-                yield (eye_id, timestamp, conf, dia_2d, dia_3d, pos_x, pos_y)
+            # Looks the always present fields up in a single C call
+            pick = operator.itemgetter("confidence", "diameter")
+            # Bound once, the loop below runs for every sample
+            # unpackb raises ExtraData for trailing bytes in a payload
+            unpackb = functools.partial(
+                msgpack.unpackb, raw=False, use_list=False)
+            islice = itertools.islice
+
+            start = 0
+            while start < n_total:
+                n_chunk = min(chunk_size, n_total - start)
+
+                rows = []
+                append = rows.append
+                # Python floats convert faster than numpy scalars
+                block_ts = data_ts[start:start + n_chunk].tolist()
+                for timestamp, (topic, payload) in zip(
+                        block_ts, islice(unpacker, n_chunk)):
+                    datum = unpackb(payload)
+                    # diameter_3d is only available for 3d detections
+                    # yield data according to csv_header() sequence
+                    append(
+                        (datum["id"], timestamp)
+                        + pick(datum)
+                        + (datum.get("diameter_3d", 0.0),)
+                        + datum["norm_pos"]
+                    )
+
+                yield rows
+                # The data ended before the timestamps
+                n_read = len(rows)
+                if n_read < n_chunk:
+                    break
+                start += n_read
     except FileNotFoundError:
         logger.warning("{} cannot be processed - file does not exist".format(ts_file))
         return
     return 
 
-def extract_eyeid_diameters(pupil_datum):
-    """Extract data for a given pupil datum
-    
-    Returns: tuple(eye_id, confidence, diameter_2d, and diameter_3d)
+def data_files(directory, topic="pupil"):
+    """Locate the data of a topic, preferring the offline detection
+
+    Returns: tuple(timestamps file, pldata file)
     """
-    return (
-        pupil_datum["id"],
-        pupil_datum["confidence"],
-        pupil_datum["diameter"],
-        pupil_datum.get("diameter_3d", 0.0),
-        pupil_datum["norm_pos"][0],
-        pupil_datum["norm_pos"][1]
-    )
+    # Join once, the files only differ by their names
+    prefix = os.path.join(directory, '')
+    offline_prefix = prefix + 'offline_data' + os.sep + 'offline_' + topic
+    if os.path.isfile(offline_prefix + "_timestamps.npy"):
+        return offline_prefix + "_timestamps.npy", offline_prefix + ".pldata"
+    return prefix + topic + "_timestamps.npy", prefix + topic + ".pldata"
 
 def extract_eyeid_messages(datum):
     """Extract data for a given pupil datum
@@ -206,14 +316,6 @@ def extract_eyeid_messages(datum):
         datum.get("label", '')
     )
 
-
-def deserialize_msgpack(msgpack_bytes):
-    """Deserialize msgpack[1] data
-
-    [1] https://msgpack.org/index.html
-    """
-    return msgpack.unpackb(msgpack_bytes, raw=False, use_list=False)
-
 if __name__ == "__main__":
     # setup logging
     logging.basicConfig(level=logging.DEBUG)
@@ -9,15 +9,18 @@ See COPYING and COPYING.LESSER for license details.
 ---------------------------------------------------------------------------~(*)
 """
 
-import collections
+import bisect
+import collections.abc
+import concurrent.futures
+import functools
 import glob
 import logging
 import os
 from shutil import copy2
 
 #import av
+import msgpack
 import numpy as np
-from scipy.interpolate import interp1d
 
 import csv_utils
 # import cv2
@@ -35,6 +38,30 @@ def enclosing_window(timestamps, idx):
     return (now + before) / 2.0, (after + now) / 2.0
 
 
+class WindowIndex(object):
+    """Precomputed `enclosing_window` results for a fixed set of timestamps."""
+
+    def __init__(self, timestamps):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.n = len(timestamps)
+        self.mids = (timestamps[:-1] + timestamps[1:]) / 2.0
+
+    def enclosing_window(self, idx):
+        before = self.mids[idx - 1] if idx > 0 else -np.inf
+        after = self.mids[idx] if idx < self.n - 1 else np.inf
+        return before, after
+
+    def enclosing_windows_all(self):
+        """
+        :return: (starts, ends) arrays with the window of every timestamp
+        """
+        if not self.n:
+            return np.empty(0), np.empty(0)
+        starts = np.concatenate(([-np.inf], self.mids))
+        ends = np.concatenate((self.mids, [np.inf]))
+        return starts, ends
+
+
 def exact_window(timestamps, index_range):
     end_index = min(index_range[1], len(timestamps) - 1)
     return (timestamps[index_range[0]], timestamps[end_index])
@@ -56,13 +83,23 @@ class Bisector(object):
             self.data_ts = np.asarray([])
             self.sorted_idc = []
         else:
-            self.data_ts = np.asarray(data_ts)
-            self.data = np.asarray(data, dtype=object)
-
-            # Find correct order once and reorder both lists in-place
+            # searchsorted is dramatically slower on non-native byte order
+            # or strided views, e.g. fields of structured arrays
+            self.data_ts = np.ascontiguousarray(data_ts, dtype=np.float64)
+
+            # Find correct order once and reorder both lists. The data is
+            # reordered as a list, boxing it into an object array and back
+            # would copy it twice. Deques are slow to index into.
+            if not isinstance(data, (list, tuple)):
+                data = list(data)
             self.sorted_idc = np.argsort(self.data_ts)
             self.data_ts = self.data_ts[self.sorted_idc]
-            self.data = self.data[self.sorted_idc].tolist()
+            self.data = [data[idx] for idx in self.sorted_idc.tolist()]
+
+        # bound method skips the np.searchsorted dispatch on every lookup
+        self._ts_searchsorted = self.data_ts.searchsorted
+        # plain list for scalar lookups in by_ts, built on first use
+        self._data_ts_list = None
 
     def by_ts(self, ts):
         """
@@ -70,10 +107,12 @@ class Bisector(object):
         :return: datum that is matching
         :raises: ValueError if no matching datum is found
         """
-        found_index = np.searchsorted(self.data_ts, ts)
+        if self._data_ts_list is None:
+            self._data_ts_list = self.data_ts.tolist()
+        found_index = bisect.bisect_left(self._data_ts_list, ts)
         try:
             found_data = self.data[found_index]
-            found_ts = self.data_ts[found_index]
+            found_ts = self._data_ts_list[found_index]
         except IndexError:
             raise ValueError
         found = found_ts == ts
@@ -87,7 +126,7 @@ class Bisector(object):
         return self.data[start_idx:stop_idx]
 
     def _start_stop_idc_for_window(self, ts_window):
-        return np.searchsorted(self.data_ts, ts_window)
+        return self._ts_searchsorted(ts_window)
 
     def __getitem__(self, key):
         return self.data[key]
@@ -114,23 +153,58 @@ class Bisector(object):
 
 
 class Mutable_Bisector(Bisector):
+    # Timestamps live in an over-allocated buffer of which the first `_n`
+    # entries are valid, so that inserting does not reallocate every time.
+    # `data_ts` is a view into that buffer: later inserts shift its values,
+    # the public `timestamps` and `init_dict_for_window` return copies.
+
+    @property
+    def data_ts(self):
+        return self._ts_buf[: self._n]
+
+    @data_ts.setter
+    def data_ts(self, data_ts):
+        self._ts_buf = np.asarray(data_ts)
+        self._n = len(self._ts_buf)
+
     def insert(self, timestamp, datum):
-        insert_idx = np.searchsorted(self.data_ts, timestamp)
-        self.data_ts = np.insert(self.data_ts, insert_idx, timestamp)
+        n = self._n
+        insert_idx = self._ts_searchsorted(timestamp)
+        if n == len(self._ts_buf):
+            grown = np.empty(max(2 * n, 16), dtype=self._ts_buf.dtype)
+            grown[:n] = self._ts_buf
+            self._ts_buf = grown
+        buf = self._ts_buf
+        buf[insert_idx + 1 : n + 1] = buf[insert_idx:n]
+        buf[insert_idx] = timestamp
+        self._n = n + 1
+        self._ts_searchsorted = self.data_ts.searchsorted
+        if self._data_ts_list is not None:
+            self._data_ts_list.insert(insert_idx, buf[insert_idx].item())
         self.data.insert(insert_idx, datum)
 
+    @property
+    def timestamps(self):
+        return self.data_ts.copy()
+
+    def init_dict_for_window(self, ts_window):
+        init_dict = super().init_dict_for_window(ts_window)
+        init_dict["data_ts"] = init_dict["data_ts"].copy()
+        return init_dict
+
 
 class Affiliator(Bisector):
     """docstring for ClassName"""
 
     def __init__(self, data=(), start_ts=(), stop_ts=()):
         super().__init__(data, start_ts)
-        self.stop_ts = np.asarray(stop_ts)
+        self.stop_ts = np.ascontiguousarray(stop_ts, dtype=np.float64)
         self.stop_ts = self.stop_ts[self.sorted_idc]
+        self._stop_ts_searchsorted = self.stop_ts.searchsorted
 
     def _start_stop_idc_for_window(self, ts_window):
-        start_idx = np.searchsorted(self.stop_ts, ts_window[0])
-        stop_idx = np.searchsorted(self.data_ts, ts_window[1])
+        start_idx = self._stop_ts_searchsorted(ts_window[0])
+        stop_idx = self._ts_searchsorted(ts_window[1])
         return start_idx, stop_idx
 
     def init_dict_for_window(self, ts_window):
@@ -150,12 +224,19 @@ def find_closest(target, source):
     -
     https://stackoverflow.com/questions/8914491/finding-the-nearest-value-and-return-the-index-of-array-in-python/8929827#8929827
     """
-    idx = np.searchsorted(target, source)
-    idx = np.clip(idx, 1, len(target) - 1)
-    left = target[idx - 1]
-    right = target[idx]
-    idx -= source - left < right - source
-    return idx
+    target = np.asarray(target)
+    src = np.atleast_1d(source)
+    idx = target.searchsorted(src)
+    np.clip(idx, 1, len(target) - 1, out=idx)
+    # distances are computed in place of the gathered neighbours instead of
+    # allocating a new temporary for each step
+    dtype = np.result_type(target, src)
+    left = target.take(idx - 1).astype(dtype, copy=False)
+    np.subtract(src, left, out=left)
+    right = target.take(idx).astype(dtype, copy=False)
+    np.subtract(right, src, out=right)
+    idx -= left < right
+    return idx.reshape(np.shape(source))[()]
 
 
 def correlate_data(data, timestamps):
@@ -172,31 +253,29 @@ def correlate_data(data, timestamps):
 
     Finally we add an index field to the datum with the associated index
     """
-    timestamps = list(timestamps)
-    data_by_frame = [[] for i in timestamps]
-
-    frame_idx = 0
-    data_index = 0
+    frame_ts = np.asarray(timestamps, dtype=np.float64)
+    data_by_frame = [[] for i in range(len(frame_ts))]
 
     data.sort(key=lambda d: d["timestamp"])
 
-    while True:
-        try:
-            datum = data[data_index]
-            # we can take the midpoint between two frames in time: More appropriate for SW timestamps
-            ts = (timestamps[frame_idx] + timestamps[frame_idx + 1]) / 2.0
-            # or the time of the next frame: More appropriate for Sart Of Exposure Timestamps (HW timestamps).
-            # ts = timestamps[frame_idx+1]
-        except IndexError:
-            # we might loose a data point at the end but we dont care
+    # we can take the midpoint between two frames in time: More appropriate for SW timestamps
+    midpoints = (frame_ts[:-1] + frame_ts[1:]) / 2.0
+    # or the time of the next frame: More appropriate for Sart Of Exposure Timestamps (HW timestamps).
+    # midpoints = frame_ts[1:]
+
+    # a datum belongs to the first frame whose window ends at or after it
+    data_ts = np.fromiter(
+        (d["timestamp"] for d in data), dtype=np.float64, count=len(data)
+    )
+    frame_idc = np.searchsorted(midpoints, data_ts, side="left")
+
+    last_frame = len(midpoints)
+    for datum, frame_idx in zip(data, frame_idc.tolist()):
+        if frame_idx == last_frame:
+            # we might loose data points at the end but we dont care
             break
-
-        if datum["timestamp"] <= ts:
-            # datum['index'] = frame_idx
-            data_by_frame[frame_idx].append(datum)
-            data_index += 1
-        else:
-            frame_idx += 1
+        # datum['index'] = frame_idx
+        data_by_frame[frame_idx].append(datum)
 
     return data_by_frame
 
@@ -295,18 +374,43 @@ def _update_info_version_to(new_version, rec_dir):
     update_meta_info(rec_dir, meta_info)
 
 
+def _load_time_file(time_loc):
+    # Pupil Mobile .time files are raw big-endian float64. They are mapped and
+    # converted to native byte order in a single copy, so that the saved
+    # timestamps do not hit the slow non-native searchsorted path later on.
+    try:
+        timestamps = np.memmap(time_loc, dtype=">f8", mode="r")
+    except ValueError:  # empty or truncated file, mmap cannot handle these
+        timestamps = np.fromfile(time_loc, dtype=">f8")
+    return np.ascontiguousarray(timestamps, dtype=np.float64)
+
+
+def _list_rec_dir(rec_dir):
+    # visible file names in directory order, like glob, and as a set of
+    # normcased names, matching like glob and os.path.exists on Windows
+    file_names = [
+        entry.name for entry in os.scandir(rec_dir) if not entry.name.startswith(".")
+    ]
+    return file_names, {os.path.normcase(name) for name in file_names}
+
+
 def convert_pupil_mobile_recording_to_v094(rec_dir):
     logger.info("Converting Pupil Mobile recording to v0.9.4 format")
     # convert time files and rename corresponding videos
-    time_pattern = os.path.join(rec_dir, "*.time")
-    for time_loc in glob.glob(time_pattern):
-        time_file_name = os.path.split(time_loc)[1]
+    # list the directory once instead of a stat per candidate media file
+    file_names, existing_names = _list_rec_dir(rec_dir)
+    for time_file_name in file_names:
+        if not os.path.normcase(time_file_name).endswith(os.path.normcase(".time")):
+            continue
+        time_loc = os.path.join(rec_dir, time_file_name)
         time_name = os.path.splitext(time_file_name)[0]
 
-        potential_locs = [
-            os.path.join(rec_dir, time_name + ext) for ext in (".mjpeg", ".mp4", ".m4a")
+        potential_names = [time_name + ext for ext in (".mjpeg", ".mp4", ".m4a")]
+        existing_locs = [
+            os.path.join(rec_dir, name)
+            for name in potential_names
+            if os.path.normcase(name) in existing_names
         ]
-        existing_locs = [loc for loc in potential_locs if os.path.exists(loc)]
         if not existing_locs:
             continue
         else:
@@ -333,10 +437,11 @@ def convert_pupil_mobile_recording_to_v094(rec_dir):
         elif time_name.startswith("audio_"):
             time_name = "audio"
 
-        timestamps = np.fromfile(time_loc, dtype=">f8")
+        timestamps = _load_time_file(time_loc)
         timestamp_loc = os.path.join(rec_dir, "{}_timestamps.npy".format(time_name))
         logger.info('Creating "{}"'.format(os.path.split(timestamp_loc)[1]))
         np.save(timestamp_loc, timestamps)
+        del timestamps
 
         if time_name == "audio":
             media_dst = os.path.join(rec_dir, time_name) + ".mp4"
@@ -356,6 +461,8 @@ def convert_pupil_mobile_recording_to_v094(rec_dir):
             # To mirror this behaviour we need to delete the old file and try renaming the new one again.
             os.remove(media_dst)
             os.rename(media_loc, media_dst)
+        existing_names.discard(os.path.normcase(os.path.split(media_loc)[1]))
+        existing_names.add(os.path.normcase(os.path.split(media_dst)[1]))
 
     pupil_data_loc = os.path.join(rec_dir, "pupil_data")
     if not os.path.exists(pupil_data_loc):
@@ -400,18 +507,24 @@ def update_recording_v086_to_v087(rec_dir):
     logger.info("Updating recording from v0.8.6 format to v0.8.7 format")
     pupil_data = fm.load_object(os.path.join(rec_dir, "pupil_data"))
 
-    def _clamp_norm_point(pos):
-        """realisitic numbers for norm pos should be in this range.
-            Grossly bigger or smaller numbers are results bad exrapolation
-            and can cause overflow erorr when denormalized and cast as int32.
-        """
-        return min(100.0, max(-100.0, pos[0])), min(100.0, max(-100.0, pos[1]))
-
-    for g in pupil_data.get("gaze_positions", []):
+    gaze_positions = pupil_data.get("gaze_positions", [])
+    for g in gaze_positions:
         if "topic" not in g:
             # we missed this in one gaze mapper
             g["topic"] = "gaze"
-        g["norm_pos"] = _clamp_norm_point(g["norm_pos"])
+
+    # realisitic numbers for norm pos should be in this range.
+    # Grossly bigger or smaller numbers are results bad exrapolation
+    # and can cause overflow erorr when denormalized and cast as int32.
+    if gaze_positions:
+        norm_pos = np.array(
+            [(g["norm_pos"][0], g["norm_pos"][1]) for g in gaze_positions],
+            dtype=np.float64,
+        )
+        norm_pos[np.isnan(norm_pos)] = -100.0  # like the former min/max clamp
+        np.clip(norm_pos, -100.0, 100.0, out=norm_pos)
+        for g, pos in zip(gaze_positions, norm_pos.tolist()):
+            g["norm_pos"] = tuple(pos)
 
     fm.save_object(pupil_data, os.path.join(rec_dir, "pupil_data"))
 
@@ -426,37 +539,79 @@ def update_recording_v087_to_v091(rec_dir):
 def update_recording_v091_to_v093(rec_dir):
     logger.info("Updating recording from v0.9.1 format to v0.9.3 format")
     pupil_data = fm.load_object(os.path.join(rec_dir, "pupil_data"))
-    for g in pupil_data.get("gaze_positions", []):
+    gaze_positions = pupil_data.get("gaze_positions", [])
+    if gaze_positions:
         # fixing recordings made with bug https://github.com/pupil-labs/pupil/issues/598
-        g["norm_pos"] = float(g["norm_pos"][0]), float(g["norm_pos"][1])
+        norm_pos = np.array(
+            [(g["norm_pos"][0], g["norm_pos"][1]) for g in gaze_positions],
+            dtype=np.float64,
+        )
+        for g, pos in zip(gaze_positions, norm_pos.tolist()):
+            g["norm_pos"] = tuple(pos)
 
     fm.save_object(pupil_data, os.path.join(rec_dir, "pupil_data"))
 
     _update_info_version_to("v0.9.3", rec_dir)
 
 
+def _convert_v093_file(rec_file):
+    # Runs in a worker process, the outcome is logged by the caller.
+    # Returns True if converted from pickle, False if it could not be read.
+    try:
+        rec_object = fm.load_object(rec_file, allow_legacy=False)
+        fm.save_object(rec_object, rec_file)
+    except:
+        try:
+            rec_object = fm.load_object(rec_file, allow_legacy=True)
+            fm.save_object(rec_object, rec_file)
+            return True
+        except:
+            return False
+
+
 def update_recording_v093_to_v094(rec_dir):
     logger.info("Updating recording from v0.9.3 to v0.9.4.")
 
-    for file in os.listdir(rec_dir):
-        if file.startswith(".") or os.path.splitext(file)[1] in (".mp4", ".avi"):
-            continue
-        rec_file = os.path.join(rec_dir, file)
+    rec_files = [
+        os.path.join(rec_dir, file)
+        for file in os.listdir(rec_dir)
+        if not file.startswith(".")
+        and os.path.splitext(file)[1] not in (".mp4", ".avi")
+    ]
 
-        try:
-            rec_object = fm.load_object(rec_file, allow_legacy=False)
-            fm.save_object(rec_object, rec_file)
-        except:
-            try:
-                rec_object = fm.load_object(rec_file, allow_legacy=True)
-                fm.save_object(rec_object, rec_file)
-                logger.info("Converted `{}` from pickle to msgpack".format(file))
-            except:
-                logger.warning("did not convert {}".format(rec_file))
+    # files are independent and transcoding them is CPU bound
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(len(rec_files), os.cpu_count() or 1) or 1
+        ) as executor:
+            results = list(executor.map(_convert_v093_file, rec_files))
+    except (OSError, concurrent.futures.BrokenExecutor) as e:
+        logger.debug("Converting without process pool: {}".format(e))
+        results = list(map(_convert_v093_file, rec_files))
+
+    for rec_file, result in zip(rec_files, results):
+        if result is True:
+            file = os.path.split(rec_file)[1]
+            logger.info("Converted `{}` from pickle to msgpack".format(file))
+        elif result is False:
+            logger.warning("did not convert {}".format(rec_file))
 
     _update_info_version_to("v0.9.4", rec_dir)
 
 
+def _interpolate_linear(x, xp, fp):
+    # Same as interp1d(xp, fp, fill_value="extrapolate") for sorted `xp`:
+    # np.interp inside the range, the end segments extended outside of it.
+    y = np.interp(x, xp, fp)
+    lo = x < xp[0]
+    slope_lo = (fp[1] - fp[0]) / (xp[1] - xp[0])
+    y[lo] = slope_lo * (x[lo] - xp[0]) + fp[0]
+    hi = x > xp[-1]
+    slope_hi = (fp[-1] - fp[-2]) / (xp[-1] - xp[-2])
+    y[hi] = slope_hi * (x[hi] - xp[-2]) + fp[-2]
+    return y
+
+
 def update_recording_v094_to_v0913(rec_dir, retry_on_averror=True):
     try:
         logger.info("Updating recording from v0.9.4 to v0.9.13")
@@ -473,15 +628,17 @@ def update_recording_v094_to_v0913(rec_dir, retry_on_averror=True):
 
             out_container = av.open(aac_file_loc, "w")
             out_stream = out_container.add_stream("aac")
+            encode = out_stream.encode
+            mux = out_container.mux
 
             for in_packet in in_container.demux():
                 for audio_frame in in_packet.decode():
                     if not in_frame_size:
                         in_frame_size = audio_frame.samples
                     in_frame_num += 1
-                    out_packet = out_stream.encode(audio_frame)
+                    out_packet = encode(audio_frame)
                     if out_packet is not None:
-                        out_container.mux(out_packet)
+                        mux(out_packet)
 
             # flush encoder
             out_packet = out_stream.encode(None)
@@ -513,10 +670,7 @@ def update_recording_v094_to_v0913(rec_dir, retry_on_averror=True):
                 / in_frame_rate
             )
             new_ts_idx = np.arange(0, out_frame_num * out_frame_size, out_frame_size)
-            interpolate = interp1d(
-                old_ts_idx, old_ts, bounds_error=False, fill_value="extrapolate"
-            )
-            new_ts = interpolate(new_ts_idx)
+            new_ts = _interpolate_linear(new_ts_idx, old_ts_idx, old_ts)
 
             # raise RuntimeError
             np.save(audio_ts_loc, new_ts)
@@ -567,15 +721,20 @@ def update_recording_v0913_to_v0915(rec_dir):
 def update_recording_v0915_v13(rec_dir):
     logger.info("Updating recording from v0.9.15 to v1.3")
     # Look for unconverted Pupil Cam2 videos
-    time_pattern = os.path.join(rec_dir, "*.time")
-    for time_loc in glob.glob(time_pattern):
-        time_file_name = os.path.split(time_loc)[1]
+    # list the directory once instead of a stat per candidate media file
+    file_names, existing_names = _list_rec_dir(rec_dir)
+    for time_file_name in file_names:
+        if not os.path.normcase(time_file_name).endswith(os.path.normcase(".time")):
+            continue
+        time_loc = os.path.join(rec_dir, time_file_name)
         time_name = os.path.splitext(time_file_name)[0]
 
-        potential_locs = [
-            os.path.join(rec_dir, time_name + ext) for ext in (".mjpeg", ".mp4", ".m4a")
+        potential_names = [time_name + ext for ext in (".mjpeg", ".mp4", ".m4a")]
+        existing_locs = [
+            os.path.join(rec_dir, name)
+            for name in potential_names
+            if os.path.normcase(name) in existing_names
         ]
-        existing_locs = [loc for loc in potential_locs if os.path.exists(loc)]
         if not existing_locs:
             continue
         else:
@@ -586,10 +745,11 @@ def update_recording_v0915_v13(rec_dir):
         else:
             continue
 
-        timestamps = np.fromfile(time_loc, dtype=">f8")
+        timestamps = _load_time_file(time_loc)
         timestamp_loc = os.path.join(rec_dir, "{}_timestamps.npy".format(time_name))
         logger.info('Creating "{}"'.format(os.path.split(timestamp_loc)[1]))
         np.save(timestamp_loc, timestamps)
+        del timestamps
 
         video_dst = os.path.join(rec_dir, time_name) + os.path.splitext(video_loc)[1]
         logger.info(
@@ -598,6 +758,8 @@ def update_recording_v0915_v13(rec_dir):
             )
         )
         os.rename(video_loc, video_dst)
+        existing_names.discard(os.path.normcase(os.path.split(video_loc)[1]))
+        existing_names.add(os.path.normcase(os.path.split(video_dst)[1]))
 
     _update_info_version_to("v1.3", rec_dir)
 
@@ -607,6 +769,20 @@ def update_recording_v13_v14(rec_dir):
     _update_info_version_to("v1.4", rec_dir)
 
 
+def _v18_topic_getter(new_topic):
+    # the v1.8 datum topic only depends on the file topic, pick its rule once
+    if new_topic == "notify":
+        return lambda datum: "notify." + datum["subject"]
+    elif new_topic == "pupil":
+        return lambda datum: datum["topic"] + ".{}".format(datum["id"])
+    elif new_topic.startswith("surface"):
+        return lambda datum: "surfaces." + datum["name"]
+    elif new_topic == "blinks" or new_topic == "fixations":
+        return lambda datum: datum["topic"] + "s"
+    else:
+        return lambda datum: datum["topic"]
+
+
 def update_recording_v14_v18(rec_dir):
     logger.info("Updating recording from v1.4 to v1.8")
     legacy_topic_mapping = {
@@ -615,21 +791,18 @@ def update_recording_v14_v18(rec_dir):
         "pupil_positions": "pupil",
     }
 
+    # same as PLData_Writer.append, but with one reused packer
+    pack = msgpack.Packer(use_bin_type=True).pack
+
     with fm.Incremental_Legacy_Pupil_Data_Loader(rec_dir) as loader:
         for old_topic, values in loader.topic_values_pairs():
             new_topic = legacy_topic_mapping.get(old_topic, old_topic)
+            topic_for = _v18_topic_getter(new_topic)
             with fm.PLData_Writer(rec_dir, new_topic) as writer:
+                append_serialized = writer.append_serialized
                 for datum in values:
-                    if new_topic == "notify":
-                        datum["topic"] = "notify." + datum["subject"]
-                    elif new_topic == "pupil":
-                        datum["topic"] += ".{}".format(datum["id"])
-                    elif new_topic.startswith("surface"):
-                        datum["topic"] = "surfaces." + datum["name"]
-                    elif new_topic == "blinks" or new_topic == "fixations":
-                        datum["topic"] += "s"
-
-                    writer.append(datum)
+                    topic = datum["topic"] = topic_for(datum)
+                    append_serialized(datum["timestamp"], topic, pack(datum))
 
     _update_info_version_to("v1.8", rec_dir)
 
@@ -678,7 +851,8 @@ def check_for_worldless_recording(rec_dir):
         max_ts = -np.inf
         for f in glob.glob(os.path.join(rec_dir, "eye*_timestamps.npy")):
             try:
-                eye_ts = np.load(f)
+                # only the first and last entries are read
+                eye_ts = np.load(f, mmap_mode="r")
                 assert len(eye_ts.shape) == 1
                 assert eye_ts.shape[0] > 1
                 min_ts = min(min_ts, eye_ts[0])
@@ -703,14 +877,29 @@ def check_for_worldless_recording(rec_dir):
 def update_recording_bytes_to_unicode(rec_dir):
     logger.info("Updating recording from bytes to unicode.")
 
+    primitive_types = (str, int, float, type(None), np.ndarray)
+
     def convert(data):
-        if isinstance(data, bytes):
+        # plain dicts and lists come first and are returned as they are if
+        # they do not contain anything that needs converting
+        data_type = type(data)
+        if data_type is dict:
+            if all(type(key) is str for key in data) and all(
+                isinstance(value, primitive_types) for value in data.values()
+            ):
+                return data
+            return {convert(key): convert(value) for key, value in data.items()}
+        elif data_type is list or data_type is tuple:
+            if all(isinstance(value, primitive_types) for value in data):
+                return data
+            return data_type(map(convert, data))
+        elif isinstance(data, bytes):
             return data.decode()
         elif isinstance(data, str) or isinstance(data, np.ndarray):
             return data
-        elif isinstance(data, collections.Mapping):
-            return dict(map(convert, data.items()))
-        elif isinstance(data, collections.Iterable):
+        elif isinstance(data, collections.abc.Mapping):
+            return {convert(key): convert(value) for key, value in data.items()}
+        elif isinstance(data, collections.abc.Iterable):
             return type(data)(map(convert, data))
         else:
             return data
@@ -777,37 +966,42 @@ def update_recording_v05_to_v074(rec_dir):
 
 def update_recording_v04_to_v074(rec_dir):
     logger.info("Updating recording from v0.4x format to v0.7.4 format")
-    gaze_array = np.load(os.path.join(rec_dir, "gaze_positions.npy"))
-    pupil_array = np.load(os.path.join(rec_dir, "pupil_positions.npy"))
-    gaze_list = []
-    pupil_list = []
-
-    for datum in pupil_array:
-        ts, confidence, id, x, y, diameter = datum[:6]
-        pupil_list.append(
-            {
-                "timestamp": ts,
-                "confidence": confidence,
-                "id": id,
-                "norm_pos": [x, y],
-                "diameter": diameter,
-                "method": "2d python",
-                "ellipse": {"angle": 0.0, "center": [0.0, 0.0], "axes": [0.0, 0.0]},
-            }
-        )
+    # read once into the column lists below, no need to hold a copy
+    gaze_array = np.load(os.path.join(rec_dir, "gaze_positions.npy"), mmap_mode="r")
+    pupil_array = np.load(
+        os.path.join(rec_dir, "pupil_positions.npy"), mmap_mode="r"
+    )
+
+    # the stored layout stays a list of dicts, later updates and Player
+    # rely on it, but the fields are taken from column slices
+    pupil_columns = pupil_array.T[:6].tolist()
+    # the same placeholder for every datum, it is written out per datum anyway
+    ellipse = {"angle": 0.0, "center": [0.0, 0.0], "axes": [0.0, 0.0]}
+    pupil_list = [
+        {
+            "timestamp": ts,
+            "confidence": confidence,
+            "id": id,
+            "norm_pos": [x, y],
+            "diameter": diameter,
+            "method": "2d python",
+            "ellipse": ellipse,
+        }
+        for ts, confidence, id, x, y, diameter in zip(*pupil_columns)
+    ]
 
-    pupil_by_ts = dict([(p["timestamp"], p) for p in pupil_list])
-
-    for datum in gaze_array:
-        ts, confidence, x, y, = datum
-        gaze_list.append(
-            {
-                "timestamp": ts,
-                "confidence": confidence,
-                "norm_pos": [x, y],
-                "base": [pupil_by_ts.get(ts, None)],
-            }
-        )
+    pupil_by_ts = {p["timestamp"]: p for p in pupil_list}
+
+    gaze_columns = gaze_array.T.tolist()
+    gaze_list = [
+        {
+            "timestamp": ts,
+            "confidence": confidence,
+            "norm_pos": [x, y],
+            "base": [pupil_by_ts.get(ts, None)],
+        }
+        for ts, confidence, x, y, in zip(*gaze_columns)
+    ]
 
     pupil_data = {"pupil_positions": pupil_list, "gaze_positions": gaze_list}
     try:
@@ -818,31 +1012,34 @@ def update_recording_v04_to_v074(rec_dir):
 
 def update_recording_v03_to_v074(rec_dir):
     logger.info("Updating recording from v0.3x format to v0.7.4 format")
-    pupilgaze_array = np.load(os.path.join(rec_dir, "gaze_positions.npy"))
-    gaze_list = []
-    pupil_list = []
-
-    for datum in pupilgaze_array:
-        gaze_x, gaze_y, pupil_x, pupil_y, ts, confidence = datum
-        # some bogus size and confidence as we did not save it back then
-        pupil_list.append(
-            {
-                "timestamp": ts,
-                "confidence": confidence,
-                "id": 0,
-                "norm_pos": [pupil_x, pupil_y],
-                "diameter": 50,
-                "method": "2d python",
-            }
-        )
-        gaze_list.append(
-            {
-                "timestamp": ts,
-                "confidence": confidence,
-                "norm_pos": [gaze_x, gaze_y],
-                "base": [pupil_list[-1]],
-            }
-        )
+    pupilgaze_array = np.load(
+        os.path.join(rec_dir, "gaze_positions.npy"), mmap_mode="r"
+    )
+
+    # unpacking plain floats from column lists is a lot cheaper than
+    # unpacking numpy rows
+    columns = pupilgaze_array.T.tolist()
+    # some bogus size and confidence as we did not save it back then
+    pupil_list = [
+        {
+            "timestamp": ts,
+            "confidence": confidence,
+            "id": 0,
+            "norm_pos": [pupil_x, pupil_y],
+            "diameter": 50,
+            "method": "2d python",
+        }
+        for gaze_x, gaze_y, pupil_x, pupil_y, ts, confidence in zip(*columns)
+    ]
+    gaze_list = [
+        {
+            "timestamp": pupil["timestamp"],
+            "confidence": pupil["confidence"],
+            "norm_pos": [gaze_x, gaze_y],
+            "base": [pupil],
+        }
+        for pupil, gaze_x, gaze_y in zip(pupil_list, *columns[:2])
+    ]
 
     pupil_data = {"pupil_positions": pupil_list, "gaze_positions": gaze_list}
     try:
@@ -850,21 +1047,63 @@ def update_recording_v03_to_v074(rec_dir):
     except IOError:
         pass
 
+    _migrate_world_timestamps(rec_dir)
+
+
+def _migrate_world_timestamps(rec_dir):
+    # v0.3 recordings name the world timestamps "timestamps.npy"
     ts_path = os.path.join(rec_dir, "world_timestamps.npy")
     ts_path_old = os.path.join(rec_dir, "timestamps.npy")
-    if not os.path.isfile(ts_path) and os.path.isfile(ts_path_old):
-        os.rename(ts_path_old, ts_path)
+    if os.path.isfile(ts_path):
+        return
+    try:
+        os.replace(ts_path_old, ts_path)
+    except FileNotFoundError:
+        pass
+
+
+# Files `load_meta_info` accepts as meta info of a recording
+META_INFO_FILES = ("info.csv", "user_info.csv")
+
+
+def is_pupil_rec_dir_fast(rec_dir, names):
+    """Cheap variant of `is_pupil_rec_dir` for callers that already listed
+    `rec_dir`: only looks for the meta info file among `names`."""
+    return any(meta_file in names for meta_file in META_INFO_FILES)
 
 
-def is_pupil_rec_dir(rec_dir):
-    if not os.path.isdir(rec_dir):
-        logger.error("No valid dir supplied ({})".format(rec_dir))
+@functools.lru_cache(maxsize=256)
+def _read_meta_info_file(meta_info_path, mtime):
+    # `mtime` is only part of the cache key, edited files are read again
+    with open(meta_info_path, "r", encoding="utf-8") as csvfile:
+        return csv_utils.read_key_value_file(csvfile)
+
+
+def is_pupil_rec_dir(rec_dir, names=None):
+    # A single listing instead of checking each meta info file, callers
+    # that already listed `rec_dir` pass its `names`
+    if names is None:
+        try:
+            with os.scandir(rec_dir) as it:
+                names = {entry.name for entry in it}
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            logger.error("No valid dir supplied ({})".format(rec_dir))
+            return False
+    if not is_pupil_rec_dir_fast(rec_dir, names):
         return False
+    # same file choice as `load_meta_info`
+    meta_info_file = "info.csv" if "info.csv" in names else "user_info.csv"
+    meta_info_path = os.path.join(rec_dir, meta_info_file)
     try:
-        meta_info = load_meta_info(rec_dir)
+        mtime = os.stat(meta_info_path).st_mtime_ns
+        meta_info = _read_meta_info_file(meta_info_path, mtime)
         # meta_info["Recording Name"]  # Test key existence
+    except FileNotFoundError:
+        # removed since the directory was listed
+        logger.debug("{} disappeared".format(meta_info_path))
+        return False
     except Exception as e:
-        print(e)
+        logger.debug(e)
         logger.error("Could not read info.csv file: Not a valid Pupil recording.")
         return False
     return True
@@ -8,7 +8,8 @@ Lesser General Public License (LGPL v3.0).
 See COPYING and COPYING.LESSER for license details.
 ---------------------------------------------------------------------------~(*)
 """
-import collections
+import collections.abc
+import concurrent.futures
 import glob
 import logging
 import os
@@ -16,8 +17,8 @@ import uuid
 from shutil import copy2
 
 # import av
+import msgpack
 import numpy as np
-from scipy.interpolate import interp1d
 
 import csv_utils
 import file_methods as fm
@@ -167,18 +168,24 @@ def update_recording_v086_to_v087(rec_dir):
     logger.info("Updating recording from v0.8.6 format to v0.8.7 format")
     pupil_data = fm.load_object(os.path.join(rec_dir, "pupil_data"))
 
-    def _clamp_norm_point(pos):
-        """realisitic numbers for norm pos should be in this range.
-            Grossly bigger or smaller numbers are results bad exrapolation
-            and can cause overflow erorr when denormalized and cast as int32.
-        """
-        return min(100.0, max(-100.0, pos[0])), min(100.0, max(-100.0, pos[1]))
-
-    for g in pupil_data.get("gaze_positions", []):
+    gaze_positions = pupil_data.get("gaze_positions", [])
+    for g in gaze_positions:
         if "topic" not in g:
             # we missed this in one gaze mapper
             g["topic"] = "gaze"
-        g["norm_pos"] = _clamp_norm_point(g["norm_pos"])
+
+    # realisitic numbers for norm pos should be in this range.
+    # Grossly bigger or smaller numbers are results bad exrapolation
+    # and can cause overflow erorr when denormalized and cast as int32.
+    if gaze_positions:
+        norm_pos = np.array(
+            [(g["norm_pos"][0], g["norm_pos"][1]) for g in gaze_positions],
+            dtype=np.float64,
+        )
+        norm_pos[np.isnan(norm_pos)] = -100.0  # like the former min/max clamp
+        np.clip(norm_pos, -100.0, 100.0, out=norm_pos)
+        for g, pos in zip(gaze_positions, norm_pos.tolist()):
+            g["norm_pos"] = tuple(pos)
 
     fm.save_object(pupil_data, os.path.join(rec_dir, "pupil_data"))
 
@@ -193,37 +200,79 @@ def update_recording_v087_to_v091(rec_dir):
 def update_recording_v091_to_v093(rec_dir):
     logger.info("Updating recording from v0.9.1 format to v0.9.3 format")
     pupil_data = fm.load_object(os.path.join(rec_dir, "pupil_data"))
-    for g in pupil_data.get("gaze_positions", []):
+    gaze_positions = pupil_data.get("gaze_positions", [])
+    if gaze_positions:
         # fixing recordings made with bug https://github.com/pupil-labs/pupil/issues/598
-        g["norm_pos"] = float(g["norm_pos"][0]), float(g["norm_pos"][1])
+        norm_pos = np.array(
+            [(g["norm_pos"][0], g["norm_pos"][1]) for g in gaze_positions],
+            dtype=np.float64,
+        )
+        for g, pos in zip(gaze_positions, norm_pos.tolist()):
+            g["norm_pos"] = tuple(pos)
 
     fm.save_object(pupil_data, os.path.join(rec_dir, "pupil_data"))
 
     _update_info_version_to("v0.9.3", rec_dir)
 
 
+def _convert_v093_file(rec_file):
+    # Runs in a worker process, the outcome is logged by the caller.
+    # Returns True if converted from pickle, False if it could not be read.
+    try:
+        rec_object = fm.load_object(rec_file, allow_legacy=False)
+        fm.save_object(rec_object, rec_file)
+    except:
+        try:
+            rec_object = fm.load_object(rec_file, allow_legacy=True)
+            fm.save_object(rec_object, rec_file)
+            return True
+        except:
+            return False
+
+
 def update_recording_v093_to_v094(rec_dir):
     logger.info("Updating recording from v0.9.3 to v0.9.4.")
 
-    for file in os.listdir(rec_dir):
-        if file.startswith(".") or os.path.splitext(file)[1] in (".mp4", ".avi"):
-            continue
-        rec_file = os.path.join(rec_dir, file)
+    rec_files = [
+        os.path.join(rec_dir, file)
+        for file in os.listdir(rec_dir)
+        if not file.startswith(".")
+        and os.path.splitext(file)[1] not in (".mp4", ".avi")
+    ]
 
-        try:
-            rec_object = fm.load_object(rec_file, allow_legacy=False)
-            fm.save_object(rec_object, rec_file)
-        except:
-            try:
-                rec_object = fm.load_object(rec_file, allow_legacy=True)
-                fm.save_object(rec_object, rec_file)
-                logger.info("Converted `{}` from pickle to msgpack".format(file))
-            except:
-                logger.warning("did not convert {}".format(rec_file))
+    # files are independent and transcoding them is CPU bound
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(len(rec_files), os.cpu_count() or 1) or 1
+        ) as executor:
+            results = list(executor.map(_convert_v093_file, rec_files))
+    except (OSError, concurrent.futures.BrokenExecutor) as e:
+        logger.debug("Converting without process pool: {}".format(e))
+        results = list(map(_convert_v093_file, rec_files))
+
+    for rec_file, result in zip(rec_files, results):
+        if result is True:
+            file = os.path.split(rec_file)[1]
+            logger.info("Converted `{}` from pickle to msgpack".format(file))
+        elif result is False:
+            logger.warning("did not convert {}".format(rec_file))
 
     _update_info_version_to("v0.9.4", rec_dir)
 
 
+def _interpolate_linear(x, xp, fp):
+    # Same as interp1d(xp, fp, fill_value="extrapolate") for sorted `xp`:
+    # np.interp inside the range, the end segments extended outside of it.
+    y = np.interp(x, xp, fp)
+    lo = x < xp[0]
+    slope_lo = (fp[1] - fp[0]) / (xp[1] - xp[0])
+    y[lo] = slope_lo * (x[lo] - xp[0]) + fp[0]
+    hi = x > xp[-1]
+    slope_hi = (fp[-1] - fp[-2]) / (xp[-1] - xp[-2])
+    y[hi] = slope_hi * (x[hi] - xp[-2]) + fp[-2]
+    return y
+
+
 def update_recording_v094_to_v0913(rec_dir, retry_on_averror=True):
     try:
         logger.info("Updating recording from v0.9.4 to v0.9.13")
@@ -240,15 +289,17 @@ def update_recording_v094_to_v0913(rec_dir, retry_on_averror=True):
 
             out_container = av.open(aac_file_loc, "w")
             out_stream = out_container.add_stream("aac")
+            encode = out_stream.encode
+            mux = out_container.mux
 
             for in_packet in in_container.demux():
                 for audio_frame in in_packet.decode():
                     if not in_frame_size:
                         in_frame_size = audio_frame.samples
                     in_frame_num += 1
-                    out_packet = out_stream.encode(audio_frame)
+                    out_packet = encode(audio_frame)
                     if out_packet is not None:
-                        out_container.mux(out_packet)
+                        mux(out_packet)
 
             # flush encoder
             out_packet = out_stream.encode(None)
@@ -280,10 +331,7 @@ def update_recording_v094_to_v0913(rec_dir, retry_on_averror=True):
                 / in_frame_rate
             )
             new_ts_idx = np.arange(0, out_frame_num * out_frame_size, out_frame_size)
-            interpolate = interp1d(
-                old_ts_idx, old_ts, bounds_error=False, fill_value="extrapolate"
-            )
-            new_ts = interpolate(new_ts_idx)
+            new_ts = _interpolate_linear(new_ts_idx, old_ts_idx, old_ts)
 
             # raise RuntimeError
             np.save(audio_ts_loc, new_ts)
@@ -336,6 +384,20 @@ def update_recording_v13_v14(rec_dir):
     _update_info_version_to("v1.4", rec_dir)
 
 
+def _v18_topic_getter(new_topic):
+    # the v1.8 datum topic only depends on the file topic, pick its rule once
+    if new_topic == "notify":
+        return lambda datum: "notify." + datum["subject"]
+    elif new_topic == "pupil":
+        return lambda datum: datum["topic"] + ".{}".format(datum["id"])
+    elif new_topic.startswith("surface"):
+        return lambda datum: "surfaces." + datum["name"]
+    elif new_topic == "blinks" or new_topic == "fixations":
+        return lambda datum: datum["topic"] + "s"
+    else:
+        return lambda datum: datum["topic"]
+
+
 def update_recording_v14_v18(rec_dir):
     logger.info("Updating recording from v1.4 to v1.8")
     legacy_topic_mapping = {
@@ -344,21 +406,18 @@ def update_recording_v14_v18(rec_dir):
         "pupil_positions": "pupil",
     }
 
+    # same as PLData_Writer.append, but with one reused packer
+    pack = msgpack.Packer(use_bin_type=True).pack
+
     with fm.Incremental_Legacy_Pupil_Data_Loader(rec_dir) as loader:
         for old_topic, values in loader.topic_values_pairs():
             new_topic = legacy_topic_mapping.get(old_topic, old_topic)
+            topic_for = _v18_topic_getter(new_topic)
             with fm.PLData_Writer(rec_dir, new_topic) as writer:
+                append_serialized = writer.append_serialized
                 for datum in values:
-                    if new_topic == "notify":
-                        datum["topic"] = "notify." + datum["subject"]
-                    elif new_topic == "pupil":
-                        datum["topic"] += ".{}".format(datum["id"])
-                    elif new_topic.startswith("surface"):
-                        datum["topic"] = "surfaces." + datum["name"]
-                    elif new_topic == "blinks" or new_topic == "fixations":
-                        datum["topic"] += "s"
-
-                    writer.append(datum)
+                    topic = datum["topic"] = topic_for(datum)
+                    append_serialized(datum["timestamp"], topic, pack(datum))
 
     _update_info_version_to("v1.8", rec_dir)
 
@@ -428,7 +487,8 @@ def check_for_worldless_recording(rec_dir):
         max_ts = -np.inf
         for f in eye_ts_files:
             try:
-                eye_ts = np.load(f)
+                # only the first and last entries are read
+                eye_ts = np.load(f, mmap_mode="r")
                 assert len(eye_ts.shape) == 1
                 assert eye_ts.shape[0] > 1
                 min_ts = min(min_ts, eye_ts[0])
@@ -472,14 +532,29 @@ def check_for_worldless_recording(rec_dir):
 def update_recording_bytes_to_unicode(rec_dir):
     logger.info("Updating recording from bytes to unicode.")
 
+    primitive_types = (str, int, float, type(None), np.ndarray)
+
     def convert(data):
-        if isinstance(data, bytes):
+        # plain dicts and lists come first and are returned as they are if
+        # they do not contain anything that needs converting
+        data_type = type(data)
+        if data_type is dict:
+            if all(type(key) is str for key in data) and all(
+                isinstance(value, primitive_types) for value in data.values()
+            ):
+                return data
+            return {convert(key): convert(value) for key, value in data.items()}
+        elif data_type is list or data_type is tuple:
+            if all(isinstance(value, primitive_types) for value in data):
+                return data
+            return data_type(map(convert, data))
+        elif isinstance(data, bytes):
             return data.decode()
         elif isinstance(data, str) or isinstance(data, np.ndarray):
             return data
-        elif isinstance(data, collections.Mapping):
-            return dict(map(convert, data.items()))
-        elif isinstance(data, collections.Iterable):
+        elif isinstance(data, collections.abc.Mapping):
+            return {convert(key): convert(value) for key, value in data.items()}
+        elif isinstance(data, collections.abc.Iterable):
             return type(data)(map(convert, data))
         else:
             return data
@@ -546,37 +621,42 @@ def update_recording_v05_to_v074(rec_dir):
 
 def update_recording_v04_to_v074(rec_dir):
     logger.info("Updating recording from v0.4x format to v0.7.4 format")
-    gaze_array = np.load(os.path.join(rec_dir, "gaze_positions.npy"))
-    pupil_array = np.load(os.path.join(rec_dir, "pupil_positions.npy"))
-    gaze_list = []
-    pupil_list = []
-
-    for datum in pupil_array:
-        ts, confidence, id, x, y, diameter = datum[:6]
-        pupil_list.append(
-            {
-                "timestamp": ts,
-                "confidence": confidence,
-                "id": id,
-                "norm_pos": [x, y],
-                "diameter": diameter,
-                "method": "2d python",
-                "ellipse": {"angle": 0.0, "center": [0.0, 0.0], "axes": [0.0, 0.0]},
-            }
-        )
-
-    pupil_by_ts = dict([(p["timestamp"], p) for p in pupil_list])
+    # read once into the column lists below, no need to hold a copy
+    gaze_array = np.load(os.path.join(rec_dir, "gaze_positions.npy"), mmap_mode="r")
+    pupil_array = np.load(
+        os.path.join(rec_dir, "pupil_positions.npy"), mmap_mode="r"
+    )
 
-    for datum in gaze_array:
-        ts, confidence, x, y, = datum
-        gaze_list.append(
-            {
-                "timestamp": ts,
-                "confidence": confidence,
-                "norm_pos": [x, y],
-                "base": [pupil_by_ts.get(ts, None)],
-            }
-        )
+    # the stored layout stays a list of dicts, later updates and Player
+    # rely on it, but the fields are taken from column slices
+    pupil_columns = pupil_array.T[:6].tolist()
+    # the same placeholder for every datum, it is written out per datum anyway
+    ellipse = {"angle": 0.0, "center": [0.0, 0.0], "axes": [0.0, 0.0]}
+    pupil_list = [
+        {
+            "timestamp": ts,
+            "confidence": confidence,
+            "id": id,
+            "norm_pos": [x, y],
+            "diameter": diameter,
+            "method": "2d python",
+            "ellipse": ellipse,
+        }
+        for ts, confidence, id, x, y, diameter in zip(*pupil_columns)
+    ]
+
+    pupil_by_ts = {p["timestamp"]: p for p in pupil_list}
+
+    gaze_columns = gaze_array.T.tolist()
+    gaze_list = [
+        {
+            "timestamp": ts,
+            "confidence": confidence,
+            "norm_pos": [x, y],
+            "base": [pupil_by_ts.get(ts, None)],
+        }
+        for ts, confidence, x, y, in zip(*gaze_columns)
+    ]
 
     pupil_data = {"pupil_positions": pupil_list, "gaze_positions": gaze_list}
     try:
@@ -587,31 +667,34 @@ def update_recording_v04_to_v074(rec_dir):
 
 def update_recording_v03_to_v074(rec_dir):
     logger.info("Updating recording from v0.3x format to v0.7.4 format")
-    pupilgaze_array = np.load(os.path.join(rec_dir, "gaze_positions.npy"))
-    gaze_list = []
-    pupil_list = []
-
-    for datum in pupilgaze_array:
-        gaze_x, gaze_y, pupil_x, pupil_y, ts, confidence = datum
-        # some bogus size and confidence as we did not save it back then
-        pupil_list.append(
-            {
-                "timestamp": ts,
-                "confidence": confidence,
-                "id": 0,
-                "norm_pos": [pupil_x, pupil_y],
-                "diameter": 50,
-                "method": "2d python",
-            }
-        )
-        gaze_list.append(
-            {
-                "timestamp": ts,
-                "confidence": confidence,
-                "norm_pos": [gaze_x, gaze_y],
-                "base": [pupil_list[-1]],
-            }
-        )
+    pupilgaze_array = np.load(
+        os.path.join(rec_dir, "gaze_positions.npy"), mmap_mode="r"
+    )
+
+    # unpacking plain floats from column lists is a lot cheaper than
+    # unpacking numpy rows
+    columns = pupilgaze_array.T.tolist()
+    # some bogus size and confidence as we did not save it back then
+    pupil_list = [
+        {
+            "timestamp": ts,
+            "confidence": confidence,
+            "id": 0,
+            "norm_pos": [pupil_x, pupil_y],
+            "diameter": 50,
+            "method": "2d python",
+        }
+        for gaze_x, gaze_y, pupil_x, pupil_y, ts, confidence in zip(*columns)
+    ]
+    gaze_list = [
+        {
+            "timestamp": pupil["timestamp"],
+            "confidence": pupil["confidence"],
+            "norm_pos": [gaze_x, gaze_y],
+            "base": [pupil],
+        }
+        for pupil, gaze_x, gaze_y in zip(pupil_list, *columns[:2])
+    ]
 
     pupil_data = {"pupil_positions": pupil_list, "gaze_positions": gaze_list}
     try:
@@ -619,7 +702,16 @@ def update_recording_v03_to_v074(rec_dir):
     except IOError:
         pass
 
+    _migrate_world_timestamps(rec_dir)
+
+
+def _migrate_world_timestamps(rec_dir):
+    # v0.3 recordings name the world timestamps "timestamps.npy"
     ts_path = os.path.join(rec_dir, "world_timestamps.npy")
     ts_path_old = os.path.join(rec_dir, "timestamps.npy")
-    if not os.path.isfile(ts_path) and os.path.isfile(ts_path_old):
-        os.rename(ts_path_old, ts_path)
+    if os.path.isfile(ts_path):
+        return
+    try:
+        os.replace(ts_path_old, ts_path)
+    except FileNotFoundError:
+        pass